@@ -8,14 +8,29 @@ __all__ = ["BZ2File", "open"]
 
 __author__ = "Nadeem Vawda <nadeem.vawda@gmail.com>"
 
+import bisect
+import collections
 import io
+import os
+import re
 import sys
 import warnings
 
 try:
-    from threading import RLock
+    from threading import RLock, Thread
 except ImportError:
     from dummy_threading import RLock
+    Thread = None
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 from bz2 import BZ2Compressor, BZ2Decompressor
 
@@ -25,14 +40,97 @@ _MODE_READ     = 1
 _MODE_READ_EOF = 2
 _MODE_WRITE    = 3
 
-_BUFFER_SIZE = 8192
+# Default amount of compressed data to read from the underlying file per
+# call to _fill_buffer(). Larger reads amortize the per-call overhead of
+# read() and BZ2Decompressor.decompress().
+_BUFFER_SIZE = 128 * 1024
+
+# Small writes are accumulated until this much data is available, and then
+# passed to the compressor together. This is the size of one bzip2 block
+# at the highest compression level.
+_WRITE_BUFFER_SIZE = 900000
+
+# Buffer size for files opened by name. A single large buffer in front of
+# the raw file means that most of our reads are served without a syscall.
+_FILE_BUFFER_SIZE = 1024 * 1024
+
+# Matches the header of a bzip2 stream: the "BZh" signature and block size,
+# followed by the magic number of either a block or the end-of-stream marker.
+_STREAM_HEADER = re.compile(b"BZh[1-9](?:1AY&SY|\x17rE8P\x90)")
+_STREAM_HEADER_SIZE = 10
+
+# An empty bzip2 stream, as produced by bz2.compress(b"").
+_EMPTY_STREAM = b"BZh9\x17rE8P\x90\x00\x00\x00\x00"
+
+# Once seek() has been called, the decompressed data of the last stream read
+# is kept for it to reuse, if it is no longer than this. Streams written by
+# parallel compressors such as pbzip2 hold 900 KB of data each.
+_MAX_CACHED_STREAM_SIZE = 1024 * 1024
+
+# Streams longer than this are not decompressed in parallel, to bound the
+# amount of compressed data buffered while looking for the next stream.
+_MAX_TASK_SIZE = 8 * 1024 * 1024
 
 _STR_TYPES = (str, unicode) if (str is bytes) else (str, bytes)
 
 # The 'x' mode for open() was introduced in Python 3.3.
 _HAS_OPEN_X_MODE = sys.version_info[:2] >= (3, 3)
 
-_builtin_open = open
+# Maps each valid mode to the mode used to open the underlying file, and
+# the corresponding _MODE_* constant.
+_MODES = {
+    "": ("rb", _MODE_READ), "r": ("rb", _MODE_READ), "rb": ("rb", _MODE_READ),
+    "w": ("wb", _MODE_WRITE), "wb": ("wb", _MODE_WRITE),
+    "a": ("ab", _MODE_WRITE), "ab": ("ab", _MODE_WRITE),
+}
+if _HAS_OPEN_X_MODE:
+    _MODES.update({"x": ("xb", _MODE_WRITE), "xb": ("xb", _MODE_WRITE)})
+
+# os.posix_fadvise() was introduced in Python 3.3, and is only available on
+# some Unix platforms.
+_HAS_FADVISE = hasattr(os, "posix_fadvise")
+
+
+# Stand-in for an RLock, used by BZ2File objects that aren't threadsafe.
+class _NullLock(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_LOCK = _NullLock()
+
+
+# Compress the chunks of data put on queue and write them to fp, until None
+# is received. Run in a background thread. If an error occurs, it is
+# appended to errors, and any further data is discarded.
+def _write_worker(queue, compressor, fp, errors):
+    while True:
+        data = queue.get()
+        if data is None:
+            return
+        if not errors:
+            try:
+                fp.write(compressor.compress(data))
+            except BaseException as e:
+                errors.append(e)
+
+
+# Decompress a complete bzip2 stream. Returns the decompressed data and the
+# finished decompressor, or None if data is not exactly one valid stream.
+def _decompress_stream(data):
+    decompressor = BZ2Decompressor()
+    try:
+        result = decompressor.decompress(data)
+        decompressor.decompress(b"")
+    except EOFError:
+        if not decompressor.unused_data:
+            return result, decompressor
+    except IOError:
+        pass
+    return None
 
 
 class BZ2File(io.BufferedIOBase):
@@ -46,7 +144,9 @@ class BZ2File(io.BufferedIOBase):
     returned as bytes, and data to be written should be given as bytes.
     """
 
-    def __init__(self, filename, mode="r", buffering=None, compresslevel=9):
+    def __init__(self, filename, mode="r", buffering=None, compresslevel=9,
+                 read_size=None, threadsafe=True, workers=None,
+                 async_write=False):
         """Open a bzip2-compressed file.
 
         If filename is a str, bytes or unicode object, it gives the name
@@ -61,14 +161,34 @@ class BZ2File(io.BufferedIOBase):
 
         If mode is 'w', 'x' or 'a', compresslevel can be a number between 1
         and 9 specifying the level of compression: 1 produces the least
-        compression, and 9 (default) produces the most compression.
+        compression, and 9 (default) produces the most compression. It can
+        also be 'auto', in which case the lowest level that still fits all
+        of the data in a single block is used if less than 900 KB of data
+        is written, and 9 is used otherwise. The compression ratio is then
+        the same as with level 9, but less memory is used for small files.
 
         If mode is 'r', the input file may be the concatenation of
-        multiple compressed streams.
+        multiple compressed streams. read_size gives the number of bytes
+        of compressed data to request from the underlying file at a time;
+        if omitted, a default of 128 KiB is used.
+
+        If threadsafe is false, the object does no internal locking, which
+        makes each call slightly cheaper. It must then not be used from
+        more than one thread at a time.
+
+        If workers is greater than 1 and the input file is seekable, the
+        streams of a multi-stream file are decompressed ahead of time by a
+        pool of that many threads. This requires concurrent.futures, and is
+        of no benefit for files consisting of a single stream.
+
+        If async_write is true, data passed to write() is compressed and
+        written to the underlying file by a background thread, so that the
+        caller can continue while compression takes place. Errors from the
+        background thread are raised by the next call to write() or close().
         """
         # This lock must be recursive, so that BufferedIOBase's
         # readline(), readlines() and writelines() don't deadlock.
-        self._lock = RLock()
+        self._lock = RLock() if threadsafe else _NULL_LOCK
         self._fp = None
         self._closefp = False
         self._mode = _MODE_CLOSED
@@ -79,32 +199,51 @@ class BZ2File(io.BufferedIOBase):
             warnings.warn("Use of 'buffering' argument is deprecated",
                           DeprecationWarning)
 
-        if not (1 <= compresslevel <= 9):
+        if not (compresslevel == "auto" or 1 <= compresslevel <= 9):
             raise ValueError("compresslevel must be between 1 and 9")
 
-        if mode in ("", "r", "rb"):
-            mode = "rb"
-            mode_code = _MODE_READ
-            self._decompressor = BZ2Decompressor()
+        if read_size is None:
+            read_size = _BUFFER_SIZE
+        elif read_size <= 0:
+            raise ValueError("read_size must be positive")
+        self._read_size = read_size
+
+        try:
+            mode, mode_code = _MODES[mode]
+        except (KeyError, TypeError):
+            mode_code = None
+        if mode_code is None:
+            raise ValueError("Invalid mode: %r" % (mode,))
+
+        if mode_code == _MODE_READ:
+            # The decompressor is created lazily by _fill_buffer(), so that
+            # files which are never read (or are rewound and then closed)
+            # don't pay for constructing one.
+            self._decompressor = None
             self._buffer = b""
             self._buffer_offset = 0
-        elif mode in ("w", "wb"):
-            mode = "wb"
-            mode_code = _MODE_WRITE
-            self._compressor = BZ2Compressor(compresslevel)
-        elif mode in ("x", "xb") and _HAS_OPEN_X_MODE:
-            mode = "xb"
-            mode_code = _MODE_WRITE
-            self._compressor = BZ2Compressor(compresslevel)
-        elif mode in ("a", "ab"):
-            mode = "ab"
-            mode_code = _MODE_WRITE
-            self._compressor = BZ2Compressor(compresslevel)
-        else:
-            raise ValueError("Invalid mode: %r" % (mode,))
+            # Seek points at stream boundaries, as (pos, fp_pos) pairs.
+            self._index = None
+            # The output of the last complete stream read, and of the one
+            # currently being read. Only collected after a call to seek().
+            self._cache_streams = False
+            self._stream_cache = None
+            self._stream_chunks = None
+            # Streams being decompressed in parallel, as (future, fp_pos)
+            # pairs, or None if decompressing serially.
+            self._executor = None
+            self._tasks = None
 
         if isinstance(filename, _STR_TYPES):
-            self._fp = _builtin_open(filename, mode)
+            self._fp = io.open(filename, mode, buffering=_FILE_BUFFER_SIZE)
+            if mode_code == _MODE_READ and _HAS_FADVISE:
+                # Ask the OS to read ahead aggressively, so that disk I/O
+                # overlaps with decompression.
+                try:
+                    os.posix_fadvise(self._fp.fileno(), 0, 0,
+                                     os.POSIX_FADV_SEQUENTIAL)
+                except OSError:
+                    pass
             self._closefp = True
             self._mode = mode_code
         elif hasattr(filename, "read") or hasattr(filename, "write"):
@@ -114,6 +253,28 @@ class BZ2File(io.BufferedIOBase):
             raise TypeError("filename must be a %s or %s object, or a file" %
                             (_STR_TYPES[0].__name__, _STR_TYPES[1].__name__))
 
+        self._seekable = (self._mode == _MODE_READ and
+                          (self._fp.seekable()
+                           if hasattr(self._fp, "seekable")
+                           else hasattr(self._fp, "seek")))
+        if self._seekable:
+            self._index = []
+            if (workers is not None and workers > 1 and
+                ThreadPoolExecutor is not None):
+                self._workers = workers
+                self._executor = ThreadPoolExecutor(workers)
+                self._start_tasks(self._fp.tell())
+
+        if self._mode == _MODE_WRITE:
+            # The compressor (and the background thread, if any) are started
+            # by the first call to _compress(), when the amount of data to be
+            # written may be known.
+            self._compresslevel = compresslevel
+            self._compressor = None
+            self._write_buffer = bytearray()
+            self._async_write = async_write and Thread is not None
+            self._write_thread = None
+
     def close(self):
         """Flush and close the file.
 
@@ -126,7 +287,20 @@ class BZ2File(io.BufferedIOBase):
             try:
                 if self._mode in (_MODE_READ, _MODE_READ_EOF):
                     self._decompressor = None
+                    if self._executor is not None:
+                        self._stop_tasks()
+                        self._executor.shutdown()
+                        self._executor = None
                 elif self._mode == _MODE_WRITE:
+                    if self._write_buffer:
+                        self._flush_write_buffer()
+                    if self._compressor is None:
+                        self._compressor = self._new_compressor(0)
+                    if self._write_thread is not None:
+                        self._write_queue.put(None)
+                        self._write_thread.join()
+                        self._write_thread = None
+                        self._check_write_errors()
                     self._fp.write(self._compressor.flush())
                     self._compressor = None
             finally:
@@ -152,9 +326,7 @@ class BZ2File(io.BufferedIOBase):
 
     def seekable(self):
         """Return whether the file supports seeking."""
-        return self.readable() and (self._fp.seekable()
-                                    if hasattr(self._fp, "seekable")
-                                    else hasattr(self._fp, "seek"))
+        return self.readable() and self._seekable
 
     def readable(self):
         """Return whether the file was opened for reading."""
@@ -182,12 +354,16 @@ class BZ2File(io.BufferedIOBase):
             self._check_not_closed()
             raise io.UnsupportedOperation("File not open for writing")
 
+    def _check_write_errors(self):
+        if self._write_errors:
+            raise self._write_errors[0]
+
     def _check_can_seek(self):
         if self._mode not in (_MODE_READ, _MODE_READ_EOF):
             self._check_not_closed()
             raise io.UnsupportedOperation("Seeking is only supported "
                                           "on files open for reading")
-        if hasattr(self._fp, "seekable") and not self._fp.seekable():
+        if not self._seekable:
             raise io.UnsupportedOperation("The underlying file object "
                                           "does not support seeking")
 
@@ -195,19 +371,28 @@ class BZ2File(io.BufferedIOBase):
     def _fill_buffer(self):
         if self._mode == _MODE_READ_EOF:
             return False
+        if self._tasks is not None:
+            return self._fill_buffer_parallel()
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = self._decompressor = BZ2Decompressor()
+            self._start_stream()
+        # Bind these once, rather than looking them up on every iteration.
+        fp_read = self._fp.read
+        read_size = self._read_size
         # Depending on the input data, our call to the decompressor may not
         # return any data. In this case, try again after reading another block.
         while self._buffer_offset == len(self._buffer):
-            rawblock = (self._decompressor.unused_data or
-                        self._fp.read(_BUFFER_SIZE))
+            rawblock = decompressor.unused_data or fp_read(read_size)
 
             if not rawblock:
                 try:
-                    self._decompressor.decompress(b"")
+                    decompressor.decompress(b"")
                 except EOFError:
                     # End-of-stream marker and end of file. We're good.
-                    self._mode = _MODE_READ_EOF
-                    self._size = self._pos
+                    if self._index is not None:
+                        self._end_stream(self._fp.tell())
+                    self._set_eof()
                     return False
                 else:
                     # Problem - we were expecting more compressed data.
@@ -215,33 +400,186 @@ class BZ2File(io.BufferedIOBase):
                                    "end-of-stream marker was reached")
 
             try:
-                self._buffer = self._decompressor.decompress(rawblock)
+                self._buffer = decompressor.decompress(rawblock)
             except EOFError:
-                # Continue to next stream.
-                self._decompressor = BZ2Decompressor()
+                # Continue to next stream. A decompressor that has already
+                # reached the end of its stream raises EOFError without
+                # consuming any input, so rawblock is only decompressed once.
+                if self._index is not None:
+                    fp_pos = self._fp.tell() - len(rawblock)
+                    self._end_stream(fp_pos)
+                decompressor = self._decompressor = BZ2Decompressor()
                 try:
-                    self._buffer = self._decompressor.decompress(rawblock)
+                    self._buffer = decompressor.decompress(rawblock)
                 except IOError:
                     # Trailing data isn't a valid bzip2 stream. We're done here.
-                    self._mode = _MODE_READ_EOF
-                    self._size = self._pos
+                    self._set_eof()
                     return False
+                if self._index is not None:
+                    self._add_seekpoint(fp_pos)
+                self._start_stream()
+            self._add_stream_output(self._buffer)
+            self._buffer_offset = 0
+        return True
+
+    # Called on reaching the end of the file, when the buffer is empty. The
+    # last decompressed block is released, rather than kept until close().
+    def _set_eof(self):
+        self._mode = _MODE_READ_EOF
+        self._size = self._pos
+        self._buffer = b""
+        self._buffer_offset = 0
+
+    # Fill the readahead buffer from the streams being decompressed by the
+    # worker threads, falling back to _fill_buffer() if that isn't possible.
+    def _fill_buffer_parallel(self):
+        while self._buffer_offset == len(self._buffer):
+            self._submit_tasks()
+            if not self._tasks:
+                if self._scan_buf or self._decompressor is None:
+                    # Either the last stream is too long to decompress in
+                    # parallel, or no complete stream was found at all.
+                    self._stop_tasks(self._scan_pos)
+                    return self._fill_buffer()
+                self._end_stream(self._scan_pos)
+                self._set_eof()
+                return False
+            future, fp_pos = self._tasks.popleft()
+            result = future.result()
+            if result is None:
+                # Not a single valid stream - this may be trailing junk, a
+                # truncated stream, or data that happened to look like a
+                # stream header. Let the serial code sort it out.
+                self._stop_tasks(fp_pos)
+                return self._fill_buffer()
+            self._end_stream(fp_pos)
+            self._buffer, self._decompressor = result
             self._buffer_offset = 0
+            if self._pos > 0:
+                self._add_seekpoint(fp_pos)
+            self._start_stream()
+            self._add_stream_output(self._buffer)
         return True
 
+    # Start decompressing the streams that follow the last one submitted,
+    # until there are enough tasks pending to keep the workers busy.
+    def _submit_tasks(self):
+        while len(self._tasks) < 2 * self._workers and not self._scan_eof:
+            match = _STREAM_HEADER.search(self._scan_buf, self._scan_from)
+            if match:
+                self._submit_task(match.start())
+            elif len(self._scan_buf) > _MAX_TASK_SIZE:
+                self._scan_eof = True
+            else:
+                self._scan_from = max(1, len(self._scan_buf) -
+                                         _STREAM_HEADER_SIZE + 1)
+                rawblock = self._fp.read(self._read_size)
+                if rawblock:
+                    self._scan_buf.extend(rawblock)
+                else:
+                    if self._scan_buf:
+                        self._submit_task(len(self._scan_buf))
+                    self._scan_eof = True
+
+    def _submit_task(self, size):
+        data = bytes(self._scan_buf[:size])
+        del self._scan_buf[:size]
+        future = self._executor.submit(_decompress_stream, data)
+        self._tasks.append((future, self._scan_pos))
+        self._scan_pos += size
+        self._scan_from = 1
+
+    # Begin decompressing in parallel from the stream starting at fp_pos.
+    def _start_tasks(self, fp_pos):
+        self._stop_tasks()
+        self._tasks = collections.deque()
+        self._scan_buf = bytearray()
+        self._scan_pos = fp_pos
+        self._scan_from = 1
+        self._scan_eof = False
+
+    # Cancel any pending tasks. If fp_pos is given, continue decompressing
+    # serially from there.
+    def _stop_tasks(self, fp_pos=None):
+        if self._tasks is not None:
+            for future, _ in self._tasks:
+                future.cancel()
+            self._tasks = None
+            self._scan_buf = None
+        if fp_pos is not None:
+            self._fp.seek(fp_pos, 0)
+
+    # Start collecting the output of a stream that begins at the current
+    # position, for _stream_cache. This is only done once seek() is used.
+    def _start_stream(self):
+        if self._cache_streams:
+            self._stream_start = self._pos
+            self._stream_chunks = []
+            self._stream_size = 0
+
+    def _add_stream_output(self, data):
+        if self._stream_chunks is not None:
+            self._stream_chunks.append(data)
+            self._stream_size += len(data)
+            if self._stream_size > _MAX_CACHED_STREAM_SIZE:
+                self._stream_chunks = None
+
+    # The stream whose output is being collected has ended, and the next
+    # stream starts at fp_pos. Save the output in _stream_cache, as a tuple
+    # of (pos, chunks, size, fp_pos). The chunks are only joined if used.
+    def _end_stream(self, fp_pos):
+        if self._stream_chunks is not None:
+            self._stream_cache = (self._stream_start, self._stream_chunks,
+                                  self._stream_size, fp_pos)
+            self._stream_chunks = None
+
+    # If pos lies within the cached stream, move there without decompressing
+    # anything. Returns True if successful.
+    def _seek_cached_stream(self, pos):
+        if self._stream_cache is None:
+            return False
+        start, chunks, size, fp_pos = self._stream_cache
+        if not start <= pos < start + size:
+            return False
+        if len(chunks) > 1:
+            chunks[:] = [b"".join(chunks)]
+        data = chunks[0]
+        # Continue with the next stream once the cached data is consumed.
+        # It must be preceded by a finished decompressor - a fresh one
+        # would reject trailing junk, or the end of the file.
+        self._rewind(start + len(data), fp_pos)
+        self._decompressor = BZ2Decompressor()
+        self._decompressor.decompress(_EMPTY_STREAM)
+        self._buffer = data
+        self._buffer_offset = pos - start
+        self._pos = pos
+        return True
+
+    # Record the start of a new stream as a seek point.
+    def _add_seekpoint(self, fp_pos):
+        if not self._index or self._pos > self._index[-1][0]:
+            self._index.append((self._pos, fp_pos))
+
+    # Return the last known seek point (pos, fp_pos) at or before pos.
+    def _find_seekpoint(self, pos):
+        if not self._index:
+            return (0, 0)
+        i = bisect.bisect_right(self._index, (pos, sys.maxsize))
+        return self._index[i - 1] if i else (0, 0)
+
     # Read data until EOF.
     # If return_data is false, consume the data without returning it.
     def _read_all(self, return_data=True):
-        # The loop assumes that _buffer_offset is 0. Ensure that this is true.
-        self._buffer = self._buffer[self._buffer_offset:]
-        self._buffer_offset = 0
-
         blocks = []
-        while self._fill_buffer():
+        fill_buffer = self._fill_buffer
+        while fill_buffer():
+            buffer = self._buffer
             if return_data:
-                blocks.append(self._buffer)
-            self._pos += len(self._buffer)
+                # Slicing from offset 0 returns the buffer itself, not a copy.
+                blocks.append(buffer[self._buffer_offset:])
+            self._pos += len(buffer) - self._buffer_offset
             self._buffer = b""
+            self._buffer_offset = 0
         if return_data:
             return b"".join(blocks)
 
@@ -256,36 +594,49 @@ class BZ2File(io.BufferedIOBase):
             self._pos += len(data)
             return data if return_data else None
 
-        # The loop assumes that _buffer_offset is 0. Ensure that this is true.
-        self._buffer = self._buffer[self._buffer_offset:]
-        self._buffer_offset = 0
-
+        # Consume the buffer by advancing _buffer_offset, rather than slicing
+        # off the unread tail - that would copy it on every iteration.
         blocks = []
-        while n > 0 and self._fill_buffer():
-            if n < len(self._buffer):
-                data = self._buffer[:n]
-                self._buffer_offset = n
-            else:
-                data = self._buffer
-                self._buffer = b""
+        fill_buffer = self._fill_buffer
+        while n > 0 and fill_buffer():
+            buffer = self._buffer
+            start = self._buffer_offset
+            end = min(start + n, len(buffer))
             if return_data:
-                blocks.append(data)
-            self._pos += len(data)
-            n -= len(data)
+                blocks.append(buffer[start:end])
+            self._buffer_offset = end
+            self._pos += end - start
+            n -= end - start
         if return_data:
             return b"".join(blocks)
 
-    def peek(self, n=0):
+    def peek(self, n=0, copy=True):
         """Return buffered data without advancing the file position.
 
         Always returns at least one byte of data, unless at EOF.
         The exact number of bytes returned is unspecified.
+
+        If copy is false, a read-only memoryview of the internal buffer
+        is returned instead of a bytes object, avoiding a copy. It stays
+        valid after the buffer is refilled, but keeps the old buffer alive
+        for as long as it is referenced. (On Python 2.6, which lacks
+        memoryview, a bytes object is always returned.)
         """
         with self._lock:
             self._check_can_read()
-            if not self._fill_buffer():
-                return b""
-            return self._buffer[self._buffer_offset:]
+            if self._fill_buffer():
+                data = self._buffer
+                offset = self._buffer_offset
+            else:
+                data = b""
+                offset = 0
+            if not copy:
+                try:
+                    return memoryview(data)[offset:]
+                except NameError:
+                    # memoryview() was introduced in Python 2.7.
+                    pass
+            return data[offset:]
 
     def read(self, size=-1):
         """Read up to size uncompressed bytes from the file.
@@ -337,7 +688,57 @@ class BZ2File(io.BufferedIOBase):
         Returns the number of bytes read (0 for EOF).
         """
         with self._lock:
-            return io.BufferedIOBase.readinto(self, b)
+            self._check_can_read()
+            try:
+                view = self._byte_view(b)
+            except (NameError, TypeError):
+                # memoryview() was introduced in Python 2.7, and doesn't
+                # support objects with only the old buffer interface there.
+                return io.BufferedIOBase.readinto(self, b)
+            # Copy straight from the decompressed buffer into b, rather than
+            # building an intermediate bytes object with read().
+            written = 0
+            while written < len(view) and self._fill_buffer():
+                written += self._copy_buffer(view, written)
+            return written
+
+    def readinto1(self, b):
+        """Read up to len(b) bytes into b, while trying to avoid
+        making multiple reads from the underlying stream.
+
+        Returns the number of bytes read (0 for EOF).
+        """
+        with self._lock:
+            self._check_can_read()
+            try:
+                view = self._byte_view(b)
+            except (NameError, TypeError):
+                # See readinto(). This may make more than one read from the
+                # underlying stream, but fills b correctly.
+                return io.BufferedIOBase.readinto(self, b)
+            if (not view or
+                (self._buffer_offset == len(self._buffer) and
+                 not self._fill_buffer())):
+                return 0
+            return self._copy_buffer(view, 0)
+
+    # Return a writable memoryview of the bytes of b.
+    def _byte_view(self, b):
+        view = memoryview(b)
+        if hasattr(view, "cast"):
+            view = view.cast("B")
+        return view
+
+    # Copy as much buffered data as fits into view[offset:].
+    # Returns the number of bytes copied.
+    def _copy_buffer(self, view, offset):
+        start = self._buffer_offset
+        end = min(start + len(view) - offset, len(self._buffer))
+        view[offset : offset + end - start] = \
+            memoryview(self._buffer)[start:end]
+        self._buffer_offset = end
+        self._pos += end - start
+        return end - start
 
     def readline(self, size=-1):
         """Read a line of uncompressed bytes from the file.
@@ -360,7 +761,26 @@ class BZ2File(io.BufferedIOBase):
                     self._buffer_offset = end
                     self._pos += len(line)
                     return line
-            return io.BufferedIOBase.readline(self, size)
+            # Otherwise, scan the buffer for a newline one chunk at a time,
+            # instead of letting BufferedIOBase.readline() call peek() and
+            # read() for us.
+            chunks = []
+            while size != 0 and self._fill_buffer():
+                start = self._buffer_offset
+                end = len(self._buffer)
+                if size > 0:
+                    end = min(end, start + size)
+                newline = self._buffer.find(b"\n", start, end) + 1
+                if newline > 0:
+                    end = newline
+                chunks.append(self._buffer[start:end])
+                self._buffer_offset = end
+                self._pos += end - start
+                if newline > 0:
+                    break
+                if size > 0:
+                    size -= end - start
+            return b"".join(chunks)
 
     def readlines(self, size=-1):
         """Read a list of lines of uncompressed bytes from the file.
@@ -385,8 +805,9 @@ class BZ2File(io.BufferedIOBase):
         """
         with self._lock:
             self._check_can_write()
-            compressed = self._compressor.compress(data)
-            self._fp.write(compressed)
+            if self._write_thread is not None:
+                self._check_write_errors()
+            self._write_data(data)
             self._pos += len(data)
             return len(data)
 
@@ -399,14 +820,97 @@ class BZ2File(io.BufferedIOBase):
         Line separators are not added between the written byte strings.
         """
         with self._lock:
-            return io.BufferedIOBase.writelines(self, seq)
-
-    # Rewind the file to the beginning of the data stream.
-    def _rewind(self):
-        self._fp.seek(0, 0)
+            self._check_can_write()
+            if self._write_thread is not None:
+                self._check_write_errors()
+            # Handle each item directly, rather than making a separate call
+            # to write() for it.
+            for data in seq:
+                self._write_data(data)
+                self._pos += len(data)
+
+    # Add data to the write buffer if it's small, flushing the buffer once it
+    # is full. Large writes are passed to the compressor without a copy.
+    def _write_data(self, data):
+        if len(data) < _WRITE_BUFFER_SIZE:
+            self._write_buffer += data
+            if len(self._write_buffer) >= _WRITE_BUFFER_SIZE:
+                self._flush_write_buffer()
+        else:
+            if self._compressor is None:
+                self._start_compressor(len(self._write_buffer) + len(data))
+            if self._write_buffer:
+                self._flush_write_buffer()
+            self._compress(data)
+
+    # Pass data to the compressor, or to the background thread if there is
+    # one, and write out any compressed output.
+    def _compress(self, data):
+        if self._compressor is None:
+            self._start_compressor(len(data))
+        if self._write_thread is not None:
+            # Take a copy, in case the caller modifies data later.
+            if isinstance(data, bytearray):
+                data = bytes(data)
+            elif not isinstance(data, bytes):
+                data = memoryview(data).tobytes()
+            self._write_queue.put(data)
+        else:
+            self._fp.write(self._compressor.compress(data))
+
+    # Start the compressor, and the background thread if needed, given the
+    # amount of data about to be compressed.
+    def _start_compressor(self, size):
+        self._compressor = self._new_compressor(size)
+        if self._async_write:
+            self._start_write_thread()
+
+    # Create the compressor, given the size of the first chunk of data to be
+    # compressed. Unless the file is being closed, this is at least
+    # _WRITE_BUFFER_SIZE bytes, or a single write() of any size.
+    def _new_compressor(self, size):
+        level = self._compresslevel
+        if level == "auto":
+            # Allow for the first stage of bzip2's compression, a run-length
+            # encoding that can expand the data by up to 25%.
+            level = min(9, (size + size // 4) // 100000 + 1)
+        return BZ2Compressor(level)
+
+    def _start_write_thread(self):
+        self._write_queue = Queue(4)
+        self._write_errors = []
+        self._write_thread = Thread(target=_write_worker,
+                                    args=(self._write_queue, self._compressor,
+                                          self._fp, self._write_errors))
+        self._write_thread.daemon = True
+        self._write_thread.start()
+
+    def _flush_write_buffer(self):
+        # No need to copy the buffer - the compressor accepts a bytearray,
+        # and _compress() copies it if it's handed to the background thread.
+        self._compress(self._write_buffer)
+        del self._write_buffer[:]
+
+    # Rewind the file to the beginning of the data stream, or to the start
+    # of the stream at the given seek point.
+    def _rewind(self, pos=0, fp_pos=0):
+        self._fp.seek(fp_pos, 0)
         self._mode = _MODE_READ
-        self._pos = 0
-        self._decompressor = BZ2Decompressor()
+        self._pos = pos
+        self._decompressor = None
+        self._buffer = b""
+        self._buffer_offset = 0
+        self._stream_chunks = None
+        if self._executor is not None:
+            self._start_tasks(fp_pos)
+
+    # Move straight to the end of the file, once its size is known.
+    def _skip_to_eof(self):
+        if self._executor is not None:
+            self._stop_tasks()
+        self._mode = _MODE_READ_EOF
+        self._pos = self._size
+        self._decompressor = None
         self._buffer = b""
         self._buffer_offset = 0
 
@@ -423,10 +927,15 @@ class BZ2File(io.BufferedIOBase):
         Returns the new file position.
 
         Note that seeking is emulated, so depending on the parameters,
-        this operation may be extremely slow.
+        this operation may be extremely slow. Seeking is faster in
+        multi-stream files, as the start of each stream that has already
+        been read is remembered, and seeking resumes from there. The data
+        of the last stream read is also kept, so seeking within it does not
+        require decompressing it again.
         """
         with self._lock:
             self._check_can_seek()
+            self._cache_streams = True
 
             # Recalculate offset as an absolute file position.
             if whence == 0:
@@ -441,11 +950,22 @@ class BZ2File(io.BufferedIOBase):
             else:
                 raise ValueError("Invalid value for whence: %s" % (whence,))
 
+            # If the file's size is already known, there's no need to
+            # decompress anything to get to (or past) the end.
+            if 0 <= self._size <= offset:
+                self._skip_to_eof()
+                return self._pos
+
+            if self._seek_cached_stream(offset):
+                return self._pos
+
             # Make it so that offset is the number of bytes to skip forward.
-            if offset < self._pos:
-                self._rewind()
-            else:
-                offset -= self._pos
+            # Restart from the closest stream boundary before the target if
+            # we're past it, or if it lets us skip over whole streams.
+            pos, fp_pos = self._find_seekpoint(offset)
+            if offset < self._pos or pos > self._pos:
+                self._rewind(pos, fp_pos)
+            offset = max(offset - self._pos, 0)
 
             # Read and discard data until we reach the desired position.
             self._read_block(offset, return_data=False)
@@ -460,7 +980,7 @@ class BZ2File(io.BufferedIOBase):
 
 
 def open(filename, mode="rb", compresslevel=9,
-         encoding=None, errors=None, newline=None):
+         encoding=None, errors=None, newline=None, read_size=None):
     """Open a bzip2-compressed file in binary or text mode.
 
     The filename argument can be an actual filename (a str, bytes or unicode
@@ -468,11 +988,13 @@ def open(filename, mode="rb", compresslevel=9,
 
     The mode argument can be "r", "rb", "w", "wb", "x", "xb", "a" or
     "ab" for binary mode, or "rt", "wt", "xt" or "at" for text mode.
-    The default mode is "rb", and the default compresslevel is 9.
+    The default mode is "rb", and the default compresslevel is 9. The
+    compresslevel can also be "auto"; see BZ2File for details.
 
     For binary mode, this function is equivalent to the BZ2File
-    constructor: BZ2File(filename, mode, compresslevel). In this case,
-    the encoding, errors and newline arguments must not be provided.
+    constructor: BZ2File(filename, mode, compresslevel=compresslevel,
+    read_size=read_size). In this case, the encoding, errors and newline
+    arguments must not be provided.
 
     For text mode, a BZ2File object is created, and wrapped in an
     io.TextIOWrapper instance with the specified encoding, error
@@ -491,7 +1013,8 @@ def open(filename, mode="rb", compresslevel=9,
             raise ValueError("Argument 'newline' not supported in binary mode")
 
     bz_mode = mode.replace("t", "")
-    binary_file = BZ2File(filename, bz_mode, compresslevel=compresslevel)
+    binary_file = BZ2File(filename, bz_mode, compresslevel=compresslevel,
+                          read_size=read_size)
 
     if "t" in mode:
         return io.TextIOWrapper(binary_file, encoding, errors, newline)
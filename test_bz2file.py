@@ -2,6 +2,7 @@ import unittest
 import bz2
 import bz2file
 from bz2file import BZ2File
+import io
 from io import BytesIO
 import os
 import platform
@@ -87,6 +88,7 @@ class BZ2FileTest(BaseTest):
         self.assertRaises(ValueError, BZ2File, "/dev/null", "rbt")
         self.assertRaises(ValueError, BZ2File, "/dev/null", compresslevel=0)
         self.assertRaises(ValueError, BZ2File, "/dev/null", compresslevel=10)
+        self.assertRaises(ValueError, BZ2File, "/dev/null", read_size=0)
 
     def testRead(self):
         self.createTempFile()
@@ -118,6 +120,51 @@ class BZ2FileTest(BaseTest):
         finally:
             bz2file._BUFFER_SIZE = buffer_size
 
+    def testReadSmallReadSize(self):
+        # Test BZ2File.read() with a read_size much smaller than a stream.
+        self.createTempFile(streams=5)
+        for read_size in (1, 7, len(self.DATA)):
+            with BZ2File(self.filename, read_size=read_size) as bz2f:
+                self.assertEqual(bz2f.read(), self.TEXT * 5)
+
+    def testReadParallel(self):
+        self.createTempFile(streams=5)
+        with BZ2File(self.filename, workers=3, read_size=100) as bz2f:
+            self.assertEqual(bz2f.read(), self.TEXT * 5)
+            bz2f.seek(len(self.TEXT) * 2 + 10)
+            self.assertEqual(bz2f.read(20), self.TEXT[10:30])
+            bz2f.seek(-len(self.TEXT) - 10, 2)
+            self.assertEqual(bz2f.read(), self.TEXT[-10:] + self.TEXT)
+        with BZ2File(BytesIO(self.DATA * 3 + bz2.compress(b"")),
+                     workers=2) as bz2f:
+            self.assertEqual(bz2f.read(), self.TEXT * 3)
+
+    def testReadParallelFallback(self):
+        self.createTempFile(streams=5, suffix=self.BAD_DATA)
+        with BZ2File(self.filename, workers=2) as bz2f:
+            self.assertEqual(bz2f.read(), self.TEXT * 5)
+        max_task_size = bz2file._MAX_TASK_SIZE
+        bz2file._MAX_TASK_SIZE = 100
+        try:
+            with BZ2File(self.filename, workers=2, read_size=10) as bz2f:
+                self.assertEqual(bz2f.read(), self.TEXT * 5)
+        finally:
+            bz2file._MAX_TASK_SIZE = max_task_size
+        with BZ2File(BytesIO(self.BAD_DATA), workers=2) as bz2f:
+            self.assertRaises(IOError, bz2f.read)
+        for data in [b"", self.DATA[:-10], self.DATA + self.DATA[:-10]]:
+            with BZ2File(BytesIO(data), workers=2) as bz2f:
+                self.assertRaises(EOFError, bz2f.read)
+
+    def testReadMultiStreamNonSeekable(self):
+        class PipeFile(BytesIO):
+            def seekable(self):
+                return False
+            def tell(self):
+                raise IOError("Illegal seek")
+        with BZ2File(PipeFile(self.DATA * 5 + self.BAD_DATA)) as bz2f:
+            self.assertEqual(bz2f.read(), self.TEXT * 5)
+
     def testReadTrailingJunk(self):
         self.createTempFile(suffix=self.BAD_DATA)
         with BZ2File(self.filename) as bz2f:
@@ -169,6 +216,27 @@ class BZ2FileTest(BaseTest):
             self.assertTrue(self.TEXT.startswith(pdata))
             self.assertEqual(bz2f.read(), self.TEXT)
 
+    def testPeekNoCopy(self):
+        try:
+            memoryview
+        except NameError:
+            return
+        self.createTempFile()
+        with BZ2File(self.filename) as bz2f:
+            bz2f.read(10)
+            pdata = bz2f.peek(copy=False)
+            self.assertIsInstance(pdata, memoryview)
+            self.assertNotEqual(len(pdata), 0)
+            self.assertTrue(self.TEXT[10:].startswith(pdata.tobytes()))
+            self.assertEqual(bz2f.read(), self.TEXT[10:])
+            pdata = bz2f.peek(copy=False)
+            self.assertIsInstance(pdata, memoryview)
+            self.assertEqual(pdata.tobytes(), b"")
+        with BZ2File(self.filename) as bz2f:
+            pdata = bz2f.peek(copy=False)
+            self.assertIsInstance(pdata, memoryview)
+            self.assertTrue(self.TEXT.startswith(pdata.tobytes()))
+
     def testReadInto(self):
         self.createTempFile()
         with BZ2File(self.filename) as bz2f:
@@ -181,6 +249,29 @@ class BZ2FileTest(BaseTest):
             self.assertEqual(bz2f.readinto(b), n)
             self.assertEqual(b[:n], self.TEXT[-n:])
 
+    def testReadIntoMultiStream(self):
+        self.createTempFile(streams=5)
+        with BZ2File(self.filename, read_size=100) as bz2f:
+            b = bytearray(len(self.TEXT) * 3)
+            self.assertEqual(bz2f.readinto(b), len(b))
+            self.assertEqual(b, self.TEXT * 3)
+            self.assertEqual(bz2f.tell(), len(b))
+            self.assertEqual(bz2f.readinto(b), len(self.TEXT) * 2)
+            self.assertEqual(b[:len(self.TEXT) * 2], self.TEXT * 2)
+            self.assertEqual(bz2f.readinto(b), 0)
+
+    def testReadInto1(self):
+        self.createTempFile(streams=2)
+        with BZ2File(self.filename) as bz2f:
+            b = bytearray(len(self.TEXT) * 2)
+            n = bz2f.readinto1(b)
+            self.assertTrue(0 < n <= len(b))
+            self.assertEqual(b[:n], (self.TEXT * 2)[:n])
+            self.assertEqual(bz2f.tell(), n)
+            self.assertEqual(bz2f.readinto1(bytearray()), 0)
+            self.assertEqual(bz2f.read(), (self.TEXT * 2)[n:])
+            self.assertEqual(bz2f.readinto1(b), 0)
+
     def testReadLine(self):
         self.createTempFile()
         with BZ2File(self.filename) as bz2f:
@@ -195,6 +286,22 @@ class BZ2FileTest(BaseTest):
             for line in self.TEXT_LINES * 5:
                 self.assertEqual(bz2f.readline(), line)
 
+    def testReadLineSize(self):
+        self.createTempFile(streams=2)
+        with BZ2File(self.filename, read_size=10) as bz2f:
+            self.assertEqual(bz2f.readline(0), b"")
+            self.assertEqual(bz2f.readline(5), self.TEXT_LINES[0][:5])
+            self.assertEqual(bz2f.readline(1000), self.TEXT_LINES[0][5:])
+            bz2f.seek(len(self.TEXT) - 10)
+            self.assertEqual(bz2f.readline(), self.TEXT_LINES[-1][-10:])
+            self.assertEqual(bz2f.readline(), self.TEXT_LINES[0])
+            bz2f.seek(len(self.TEXT) - 3)
+            self.assertEqual(bz2f.readline(15), self.TEXT_LINES[-1][-3:])
+            self.assertEqual(bz2f.readline(15), self.TEXT_LINES[0][:15])
+            bz2f.seek(-5, 2)
+            self.assertEqual(bz2f.readline(), self.TEXT[-5:])
+            self.assertEqual(bz2f.readline(), b"")
+
     def testReadLines(self):
         self.createTempFile()
         with BZ2File(self.filename) as bz2f:
@@ -245,6 +352,42 @@ class BZ2FileTest(BaseTest):
         with open(self.filename, 'rb') as f:
             self.assertEqual(self.decompress(f.read()), self.TEXT)
 
+    def testWriteAsync(self):
+        with BZ2File(self.filename, "w", async_write=True) as bz2f:
+            bz2f.write(bytearray(self.TEXT))
+            bz2f.writelines(self.TEXT_LINES)
+            self.assertEqual(bz2f.tell(), len(self.TEXT) * 2)
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(self.decompress(f.read()), self.TEXT * 2)
+
+    def testWriteAsyncError(self):
+        class BrokenFile(BytesIO):
+            def write(self, data):
+                raise IOError("write failed")
+        bz2f = BZ2File(BrokenFile(), "w", async_write=True)
+        bz2f.write(b"x" * 1000000)
+        self.assertRaises(IOError, bz2f.close)
+        self.assertTrue(bz2f.closed)
+
+    def testWriteBuffered(self):
+        # Test a mixture of writes smaller and larger than the write buffer.
+        buffer_size = bz2file._WRITE_BUFFER_SIZE
+        bz2file._WRITE_BUFFER_SIZE = 100
+        try:
+            with BZ2File(self.filename, "w") as bz2f:
+                bz2f.write(self.TEXT[:10])
+                bz2f.write(self.TEXT[10:200])
+                bz2f.write(self.TEXT[200:500])
+                bz2f.writelines(self.TEXT_LINES)
+                bz2f.write(self.TEXT[500:])
+                bz2f.writelines([b"x", self.TEXT, b"y"])
+            expected = (self.TEXT[:500] + self.TEXT + self.TEXT[500:] +
+                        b"x" + self.TEXT + b"y")
+            with open(self.filename, 'rb') as f:
+                self.assertEqual(self.decompress(f.read()), expected)
+        finally:
+            bz2file._WRITE_BUFFER_SIZE = buffer_size
+
     def testWriteNonDefaultCompressLevel(self):
         expected = bz2.compress(self.TEXT, compresslevel=5)
         with BZ2File(self.filename, "w", compresslevel=5) as bz2f:
@@ -252,6 +395,14 @@ class BZ2FileTest(BaseTest):
         with open(self.filename, "rb") as f:
             self.assertEqual(f.read(), expected)
 
+    def testWriteAutoCompressLevel(self):
+        for data, level in [(b"", 1), (self.TEXT, 1), (b"x" * 200000, 3),
+                            (os.urandom(1000000), 9)]:
+            with BZ2File(self.filename, "w", compresslevel="auto") as bz2f:
+                bz2f.write(data)
+            with open(self.filename, "rb") as f:
+                self.assertEqual(f.read(), bz2.compress(data, level))
+
     def testWriteLines(self):
         with BZ2File(self.filename, "w") as bz2f:
             self.assertRaises(TypeError, bz2f.writelines)
@@ -310,6 +461,38 @@ class BZ2FileTest(BaseTest):
             bz2f.seek(-150, 1)
             self.assertEqual(bz2f.read(), self.TEXT[100-150:] + self.TEXT)
 
+    def testSeekIndexedStreams(self):
+        self.createTempFile(streams=5)
+        with BZ2File(self.filename) as bz2f:
+            bz2f.seek(0, 2)
+            self.assertEqual(len(bz2f._index), 4)
+            bz2f.seek(len(self.TEXT) * 3 + 100)
+            self.assertEqual(bz2f.read(200), self.TEXT[100:300])
+            bz2f.seek(len(self.TEXT) - 100)
+            self.assertEqual(bz2f.read(200), self.TEXT[-100:] + self.TEXT[:100])
+            bz2f.seek(-150, 2)
+            self.assertEqual(bz2f.read(), self.TEXT[-150:])
+            bz2f.seek(len(self.TEXT) * 2)
+            self.assertEqual(bz2f.read(), self.TEXT * 3)
+            self.assertEqual(len(bz2f._index), 4)
+
+    def testSeekCachedStream(self):
+        self.createTempFile(streams=3, suffix=self.BAD_DATA)
+        with BZ2File(self.filename) as bz2f:
+            self.assertEqual(bz2f.read(), self.TEXT * 3)
+            self.assertIsNone(bz2f._stream_cache)
+            bz2f.seek(0)
+            self.assertEqual(bz2f.read(), self.TEXT * 3)
+            self.assertEqual(bz2f._stream_cache[0], len(self.TEXT) * 2)
+            bz2f.seek(-100, 2)
+            self.assertEqual(bz2f.read(50), self.TEXT[-100:-50])
+            bz2f.seek(len(self.TEXT) * 2)
+            self.assertEqual(bz2f.read(), self.TEXT)
+            bz2f.seek(len(self.TEXT) - 10)
+            self.assertEqual(bz2f.read(20), self.TEXT[-10:] + self.TEXT[:10])
+            bz2f.seek(5)
+            self.assertEqual(bz2f.read(), self.TEXT[5:] + self.TEXT * 2)
+
     def testSeekBackwardsFromEnd(self):
         self.createTempFile()
         with BZ2File(self.filename) as bz2f:
@@ -352,6 +535,16 @@ class BZ2FileTest(BaseTest):
             self.assertEqual(bz2f.tell(), len(self.TEXT) * 5)
             self.assertEqual(bz2f.read(), b"")
 
+    def testSeekPostEndKnownSize(self):
+        self.createTempFile(streams=2)
+        with BZ2File(self.filename) as bz2f:
+            self.assertEqual(bz2f.seek(0, 2), len(self.TEXT) * 2)
+            bz2f.seek(10)
+            self.assertEqual(bz2f.seek(150000), len(self.TEXT) * 2)
+            self.assertEqual(bz2f.read(), b"")
+            bz2f.seek(-10, 1)
+            self.assertEqual(bz2f.read(), self.TEXT[-10:])
+
     def testSeekPreStart(self):
         self.createTempFile()
         with BZ2File(self.filename) as bz2f:
@@ -359,6 +552,23 @@ class BZ2FileTest(BaseTest):
             self.assertEqual(bz2f.tell(), 0)
             self.assertEqual(bz2f.read(), self.TEXT)
 
+    def testSeekPreStartPosition(self):
+        self.createTempFile(streams=2)
+        with BZ2File(self.filename) as bz2f:
+            bz2f.seek(-150)
+            self.assertEqual(bz2f.readline(), self.TEXT_LINES[0])
+            self.assertEqual(bz2f.tell(), len(self.TEXT_LINES[0]))
+            bz2f.seek(-150)
+            self.assertEqual(bz2f.read(), self.TEXT * 2)
+            self.assertEqual(bz2f.tell(), len(self.TEXT) * 2)
+            bz2f.seek(-150)
+            self.assertEqual(bz2f.seek(0, 2), len(self.TEXT) * 2)
+            bz2f.seek(-150)
+            b = bytearray(1000)
+            self.assertEqual(bz2f.readinto(b), 1000)
+            self.assertEqual(b, (self.TEXT * 2)[:1000])
+            self.assertEqual(bz2f.tell(), 1000)
+
     def testSeekPreStartMultiStream(self):
         self.createTempFile(streams=2)
         with BZ2File(self.filename) as bz2f:
@@ -398,6 +608,7 @@ class BZ2FileTest(BaseTest):
         bz2f = BZ2File(src)
         try:
             self.assertFalse(bz2f.seekable())
+            self.assertRaises(io.UnsupportedOperation, bz2f.seek, 0)
         finally:
             bz2f.close()
         self.assertRaises(ValueError, bz2f.seekable)
@@ -505,6 +716,15 @@ class BZ2FileTest(BaseTest):
         with module.BZ2File(self.filename, "rb") as f:
             self.assertEqual(f.read(), b"abc")
 
+    def testNotThreadsafe(self):
+        with BZ2File(self.filename, "wb", threadsafe=False) as f:
+            f.writelines(self.TEXT_LINES)
+        with BZ2File(self.filename, "rb", threadsafe=False) as f:
+            self.assertEqual(f.readline(), self.TEXT_LINES[0])
+            self.assertEqual(f.readlines(), self.TEXT_LINES[1:])
+            f.seek(0)
+            self.assertEqual(f.read(), self.TEXT)
+
     def testMixedIterationAndReads(self):
         self.createTempFile()
         linelen = len(self.TEXT_LINES[0])